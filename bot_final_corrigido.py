@@ -1,15 +1,24 @@
 import os
+import re
+import json
+import hashlib
+import time
+import asyncio
 import logging
-import requests
-from bs4 import BeautifulSoup
+import httpx
+from cachetools import TTLCache
+from tenacity import retry, retry_if_exception, stop_after_attempt, stop_after_delay, wait_random_exponential
 from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
-from openai import OpenAI
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime
-from sqlalchemy.orm import sessionmaker
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, LinkPreviewOptions, Message
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from telegram.helpers import escape_markdown
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, Defaults, filters
+from sqlalchemy import create_engine, event, func, Column, Integer, String, Float, DateTime, Index, UniqueConstraint
+from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
-from datetime import datetime
+from sqlalchemy.pool import QueuePool
+from contextlib import contextmanager
+from datetime import datetime, timedelta, time as dtime
 
 # --- Configuração de Logging ---
 logging.basicConfig(
@@ -28,7 +37,24 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 # Em um deploy real no Render, você usaria um banco de dados externo (PostgreSQL)
 # Mas para manter o código funcional e autocontido, usaremos SQLite.
 DATABASE_URL = "sqlite:///financebot.db"
-Engine = create_engine(DATABASE_URL)
+Engine = create_engine(
+    DATABASE_URL,
+    poolclass=QueuePool, # Reaproveita conexões em vez de abrir uma por handler
+    pool_size=5,
+    max_overflow=10,
+    pool_pre_ping=True,
+    pool_recycle=3600,
+    connect_args={"check_same_thread": False}
+)
+
+@event.listens_for(Engine, "connect")
+def configurar_sqlite(dbapi_connection, connection_record):
+    """Ativa o modo WAL para que leituras não fiquem bloqueadas por escritas."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
 Base = declarative_base()
 
 # Definição do Modelo de Compra
@@ -41,40 +67,306 @@ class Purchase(Base):
     category = Column(String)
     date = Column(DateTime, default=datetime.now)
 
-# Cria as tabelas no banco de dados (se não existirem)
-Base.metadata.create_all(Engine)
-Session = sessionmaker(bind=Engine)
+# Lotes da revisão semanal ainda não entregues; ficam no banco para que um reinício
+# do bot não perca um lote já pago na Batch API
+class PendingReview(Base):
+    __tablename__ = 'pending_reviews'
+    id = Column(Integer, primary_key=True)
+    batch_id = Column(String, unique=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+class DeliveredReview(Base):
+    __tablename__ = 'delivered_reviews'
+    __table_args__ = (UniqueConstraint('batch_id', 'user_id'),)
+    id = Column(Integer, primary_key=True)
+    batch_id = Column(String, nullable=False)
+    user_id = Column(Integer, nullable=False)
+
+# Índice para buscar as compras de um usuário já ordenadas pela data
+ix_purchases_user_date = Index('ix_purchases_user_date', Purchase.user_id, Purchase.date.desc())
+
+def init_db() -> None:
+    """Cria as tabelas e índices no banco de dados (se não existirem)."""
+    Base.metadata.create_all(Engine)
+    # create_all não adiciona índices a tabelas que já existem
+    ix_purchases_user_date.create(Engine, checkfirst=True)
+
+Session = scoped_session(sessionmaker(bind=Engine, expire_on_commit=False))
+
+@contextmanager
+def db():
+    """Abre uma sessão, faz commit ao final (ou rollback em caso de erro) e a libera."""
+    session = Session()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        Session.remove()
+
+# As consultas abaixo são síncronas (SQLAlchemy); os handlers as executam com
+# asyncio.to_thread para que o acesso ao disco não trave o event loop.
+
+def _filtro_compras(user_id: int, desde: datetime = None) -> list:
+    """Condições para selecionar as compras do usuário, opcionalmente só a partir de `desde`."""
+    filtros = [Purchase.user_id == user_id]
+    if desde is not None:
+        filtros.append(Purchase.date >= desde)
+    return filtros
+
+def _resumo_gastos(user_id: int, limite: int, desde: datetime = None) -> tuple:
+    """Retorna (total gasto, número de compras, id da última compra, últimas `limite` compras).
+
+    Soma, contagem e maior id são calculados no banco, então só as compras exibidas são carregadas.
+    Com `desde`, considera apenas as compras a partir dessa data.
+    """
+    filtros = _filtro_compras(user_id, desde)
+    with db() as s:
+        total_spent, num_purchases, ultimo_id = s.query(
+            func.coalesce(func.sum(Purchase.value), 0.0), func.count(Purchase.id), func.max(Purchase.id)
+        ).filter(*filtros).one()
+        recentes = (
+            s.query(Purchase)
+            .filter(*filtros)
+            .order_by(Purchase.date.desc(), Purchase.id.desc())
+            .limit(limite)
+            .all()
+        )
+    return total_spent, num_purchases, ultimo_id, recentes
+
+def _gastos_por_categoria(user_id: int, desde: datetime = None) -> list:
+    """Retorna (categoria, total, número de compras) do usuário, da categoria com mais gastos para a com menos."""
+    with db() as s:
+        return (
+            s.query(Purchase.category, func.sum(Purchase.value), func.count(Purchase.id))
+            .filter(*_filtro_compras(user_id, desde))
+            .group_by(Purchase.category)
+            .order_by(func.sum(Purchase.value).desc())
+            .all()
+        )
+
+def _usuarios_com_compras_desde(desde: datetime) -> list:
+    """Retorna os ids dos usuários que registraram compras a partir de `desde`."""
+    with db() as s:
+        rows = s.query(Purchase.user_id).filter(Purchase.date >= desde).distinct().all()
+    return [user_id for (user_id,) in rows]
+
+def _registrar_revisao_pendente(batch_id: str) -> None:
+    """Guarda o id de um lote da revisão semanal que ainda será entregue."""
+    with db() as s:
+        s.add(PendingReview(batch_id=batch_id))
+
+def _remover_revisao_pendente(batch_id: str) -> None:
+    """Remove um lote da revisão semanal que já terminou (e o registro das entregas dele)."""
+    with db() as s:
+        s.query(PendingReview).filter_by(batch_id=batch_id).delete()
+        s.query(DeliveredReview).filter_by(batch_id=batch_id).delete()
+
+def _revisoes_pendentes() -> list:
+    """Retorna os ids dos lotes da revisão semanal ainda não entregues."""
+    with db() as s:
+        return [batch_id for (batch_id,) in s.query(PendingReview.batch_id).all()]
+
+def _revisoes_entregues(batch_id: str) -> set:
+    """Retorna os usuários que já receberam a revisão de um lote."""
+    with db() as s:
+        return {user_id for (user_id,) in s.query(DeliveredReview.user_id).filter_by(batch_id=batch_id).all()}
+
+def _marcar_revisao_entregue(batch_id: str, user_id: int) -> None:
+    """Registra que um usuário já recebeu a revisão de um lote, para não reenviar."""
+    with db() as s:
+        s.add(DeliveredReview(batch_id=batch_id, user_id=user_id))
+
+def _registrar_compra(user_id: int, produto: str, valor: float, categoria: str) -> None:
+    """Salva uma nova compra no banco."""
+    with db() as s:
+        s.add(Purchase(
+            user_id=user_id,
+            product=produto,
+            value=valor,
+            category=categoria
+        ))
+
+def _registrar_compras(user_id: int, rows: list) -> None:
+    """Salva várias compras (produto, valor, categoria) de uma vez, com um único commit."""
+    with db() as s:
+        s.bulk_save_objects([
+            Purchase(user_id=user_id, product=produto, value=valor, category=categoria)
+            for produto, valor, categoria in rows
+        ])
+
+async def importar_compras(user_id: int, rows: list) -> int:
+    """Importa as compras em lote sem bloquear o event loop e retorna quantas foram salvas."""
+    await asyncio.to_thread(_registrar_compras, user_id, rows)
+    return len(rows)
 
 # --- Configuração da OpenAI ---
-if OPENAI_API_KEY:
-    openai_client = OpenAI(api_key=OPENAI_API_KEY)
-else:
+# O SDK da OpenAI só é importado no primeiro uso da IA, para o bot iniciar mais rápido.
+if not OPENAI_API_KEY:
     logger.warning("OPENAI_API_KEY não encontrado. A funcionalidade de IA estará desativada.")
-    openai_client = None
+
+_openai_client = None
+
+def obter_openai_client():
+    """Retorna o cliente da OpenAI, criando-o no primeiro uso (None se não houver chave)."""
+    global _openai_client
+    if _openai_client is None and OPENAI_API_KEY:
+        from openai import AsyncOpenAI
+        # O SDK já refaz as chamadas que falham com 429/5xx, com backoff exponencial e
+        # respeitando o cabeçalho Retry-After; aqui só aumentamos o número de tentativas.
+        _openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=3)
+    return _openai_client
+
+# --- Formatação (MarkdownV2) ---
+# As mensagens com formatação usam MarkdownV2; todo texto dinâmico passa por esc()
+# e toda URL de link por esc_url().
+
+def esc(texto) -> str:
+    """Escapa um texto para ser enviado com parse_mode='MarkdownV2'."""
+    return escape_markdown(str(texto), version=2)
+
+def esc_url(url: str) -> str:
+    """Escapa a URL de um link [texto](url) em MarkdownV2."""
+    return escape_markdown(url, version=2, entity_type='text_link')
+
+# --- Cliente HTTP compartilhado ---
+# Um único cliente assíncrono reaproveitado entre as chamadas, para não bloquear
+# o event loop e não abrir uma conexão nova a cada busca. Com HTTP/2 e o pool de
+# conexões, o handshake TLS com cada host é feito uma vez só.
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+_http_client = None
+
+def obter_http_client() -> httpx.AsyncClient:
+    """Retorna o cliente HTTP compartilhado, criando-o no primeiro uso."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+            timeout=15.0,
+            headers={'User-Agent': USER_AGENT},
+            follow_redirects=True
+        )
+    return _http_client
+
+async def fechar_http_client() -> None:
+    """Fecha o cliente HTTP compartilhado."""
+    if _http_client is not None:
+        await _http_client.aclose()
 
 # --- Funções de API e Scraping ---
 
+DISCOUNT_API_URL = "https://api.discountapi.com/v2/deals"
+DISCOUNT_PARAMS = {
+    "api_key": DISCOUNT_API_KEY,
+    "limit": 5 # Limitar para 5 para uma resposta rápida
+}
+
+# Cache em memória das respostas externas. A lista de deals muda poucas vezes por
+# hora e a Shopee limita requisições, então usuários simultâneos compartilham o
+# mesmo resultado enquanto ele estiver válido.
+_deals_cache = TTLCache(maxsize=1, ttl=120)
+_deals_lock = asyncio.Lock()
+# Uma falha da DiscountAPI também fica guardada por alguns segundos, para que quem estava
+# esperando o lock receba o erro na hora em vez de repetir todas as tentativas
+_deals_falha_cache = TTLCache(maxsize=1, ttl=30)
+_shopee_cache = TTLCache(maxsize=256, ttl=600)
+
+# Links de produto da Shopee no formato /product/<loja>/<item>
+PRODUCT_RE = re.compile(r'/product/\d+/\d+')
+
+def _erro_transitorio(exc: BaseException) -> bool:
+    """Indica se vale a pena tentar a requisição de novo (falha de rede, 429 ou 5xx)."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    return isinstance(exc, httpx.TransportError)
+
+# Limites das novas tentativas: o usuário está esperando a resposta no chat
+TEMPO_MAX_RETRY = 8 # segundos desde a primeira tentativa
+ESPERA_MAX_RETRY = 4.0 # segundos entre duas tentativas, mesmo com Retry-After maior
+
+_espera_exponencial = wait_random_exponential(multiplier=0.5, max=ESPERA_MAX_RETRY)
+
+def _espera_retry(retry_state) -> float:
+    """Usa o Retry-After enviado pelo servidor, se houver; senão, backoff exponencial com jitter."""
+    exc = retry_state.outcome.exception()
+    if isinstance(exc, httpx.HTTPStatusError):
+        retry_after = exc.response.headers.get('Retry-After', '')
+        if retry_after.isdigit():
+            return min(float(retry_after), ESPERA_MAX_RETRY)
+    return _espera_exponencial(retry_state)
+
+@retry(
+    wait=_espera_retry,
+    stop=stop_after_attempt(4) | stop_after_delay(TEMPO_MAX_RETRY),
+    retry=retry_if_exception(_erro_transitorio),
+    reraise=True
+)
+async def _get_com_retry(url: str, **kwargs) -> httpx.Response:
+    """GET no cliente compartilhado, refeito em caso de erro transitório."""
+    response = await obter_http_client().get(url, **kwargs)
+    response.raise_for_status()
+    return response
+
+async def _fetch_deals() -> dict:
+    """Retorna o JSON bruto da DiscountAPI, usando o cache quando possível."""
+    async with _deals_lock:
+        if 'deals' in _deals_cache:
+            return _deals_cache['deals']
+        if 'erro' in _deals_falha_cache:
+            raise _deals_falha_cache['erro']
+
+        try:
+            response = await _get_com_retry(DISCOUNT_API_URL, params=DISCOUNT_PARAMS, timeout=10)
+            # Um corpo que não é JSON levanta ValueError (json.JSONDecodeError), tratado por quem chama
+            data = response.json()
+            if not isinstance(data, dict):
+                raise ValueError(f"Resposta inesperada da DiscountAPI: {type(data).__name__}")
+        except (httpx.HTTPError, ValueError) as e:
+            _deals_falha_cache['erro'] = e
+            raise
+        _deals_cache['deals'] = data
+        return data
+
+async def _fetch_shopee(termo: str) -> list:
+    """Retorna os links de produtos da busca na Shopee, usando o cache quando possível."""
+    chave = termo.lower()
+    if chave in _shopee_cache:
+        return _shopee_cache[chave]
+
+    url = f"https://shopee.com.br/search?keyword={termo.replace(' ', '%20')}"
+    response = await _get_com_retry(url)
+
+    # Parser HTML em C (lexbor): bem mais rápido que o html.parser em páginas grandes.
+    # Importado aqui para não pesar na partida do bot.
+    from selectolax.lexbor import LexborHTMLParser
+    tree = LexborHTMLParser(response.text)
+    product_links = []
+    for node in tree.css('a[href*="/product/"]'):
+        href = node.attributes.get('href') or ''
+        if PRODUCT_RE.search(href):
+            product_links.append(href)
+            if len(product_links) == 3:
+                break
+    _shopee_cache[chave] = product_links
+    return product_links
+
 async def buscar_discount_api_real(context: ContextTypes.DEFAULT_TYPE):
     """Busca promoções na DiscountAPI."""
-    # ... (código da DiscountAPI permanece o mesmo) ...
     logger.info("🔍 Buscando promoções na DiscountAPI...")
-    url = "https://api.discountapi.com/v2/deals"
-    params = {
-        "api_key": DISCOUNT_API_KEY,
-        "limit": 5 # Limitar para 5 para uma resposta rápida
-    }
     
     try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        data = await _fetch_deals()
         
         deals = data.get("deals", [])
         
         if not deals:
-            return "Nenhuma promoção incrível encontrada no momento. Tente mais tarde!"
+            return esc("Nenhuma promoção incrível encontrada no momento. Tente mais tarde!")
 
-        message_text = "✨ **Melhores Deals do Dia** ✨\n\n"
+        message_text = "✨ *Melhores Deals do Dia* ✨\n\n"
         
         for item in deals:
             deal = item.get("deal", {})
@@ -86,140 +378,396 @@ async def buscar_discount_api_real(context: ContextTypes.DEFAULT_TYPE):
             
             # Formatação melhorada com links clicáveis
             message_text += (
-                f"🏷️ **{title}**\n"
-                f"💰 Preço: ${price} | Desconto: {discount:.1f}%\n"
-                f"🏪 Loja: {provider}\n"
-                f"[🔗 Ver Oferta]({link})\n\n"
+                f"🏷️ *{esc(title)}*\n"
+                f"💰 {esc(f'Preço: ${price} | Desconto: {discount:.1f}%')}\n"
+                f"🏪 Loja: {esc(provider)}\n"
+                f"[🔗 Ver Oferta]({esc_url(link)})\n\n"
             )
             logger.info(f"✅ {title} - ${price} ({discount:.1f}% OFF)")
             
         logger.info(f"✅ Total de {len(deals)} promoções encontradas!")
         return message_text
         
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, ValueError) as e:
         logger.error(f"Erro ao buscar DiscountAPI: {e}")
-        return "❌ Ocorreu um erro ao buscar as promoções. Verifique a chave da API."
+        return esc("❌ Ocorreu um erro ao buscar as promoções. Verifique a chave da API.")
 
 async def buscar_shopee_scraping(termo: str):
     """Realiza web scraping na Shopee para buscar produtos."""
-    # ... (código da Shopee permanece o mesmo) ...
     logger.info(f"🛍️ Buscando na Shopee por: {termo}")
     url = f"https://shopee.com.br/search?keyword={termo.replace(' ', '%20')}"
     
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    
     try:
-        response = requests.get(url, headers=headers, timeout=15)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        product_links = [a['href'] for a in soup.find_all('a', href=True) if '/product/' in a['href']][:3]
+        product_links = await _fetch_shopee(termo)
         
         if not product_links:
             return (
-                f"❌ O scraping da Shopee falhou ou não encontrou resultados para '{termo}'.\n"
-                "Isso é comum, pois a Shopee usa carregamento dinâmico (JavaScript).\n\n"
-                "**Links Simulados (para demonstrar a funcionalidade):**\n"
-                f"🔗 [Produto 1 - {termo}]({url})\n"
-                f"🔗 [Produto 2 - {termo}]({url})\n"
+                esc(f"❌ O scraping da Shopee falhou ou não encontrou resultados para '{termo}'.\n"
+                    "Isso é comum, pois a Shopee usa carregamento dinâmico (JavaScript).") + "\n\n"
+                f"*{esc('Links Simulados (para demonstrar a funcionalidade):')}*\n"
+                f"🔗 [{esc(f'Produto 1 - {termo}')}]({esc_url(url)})\n"
+                f"🔗 [{esc(f'Produto 2 - {termo}')}]({esc_url(url)})\n"
             )
         
-        message_text = f"🛍️ **Resultados da Shopee para '{termo}'** 🛍️\n\n"
+        titulo = esc(f"Resultados da Shopee para '{termo}'")
+        message_text = f"🛍️ *{titulo}* 🛍️\n\n"
         for i, link in enumerate(product_links):
             full_link = f"https://shopee.com.br{link}" if link.startswith('/') else link
-            message_text += f"🔗 [Produto {i+1}]({full_link})\n"
+            message_text += f"🔗 [Produto {i+1}]({esc_url(full_link)})\n"
             
         return message_text
         
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"Erro ao buscar Shopee: {e}")
-        return "❌ Ocorreu um erro de conexão ao tentar buscar na Shopee."
+        return esc("❌ Ocorreu um erro de conexão ao tentar buscar na Shopee.")
 
 # --- Nova Função: IA para Análise Financeira e Respostas Inteligentes ---
 
-async def analisar_com_ia(user_id: int, prompt: str):
-    """Usa a IA para analisar o histórico de gastos e responder perguntas."""
-    if not openai_client:
-        return "❌ A funcionalidade de IA está desativada (chave da OpenAI não configurada)."
+SYSTEM_PROMPT_IA = (
+    "Você é o FinanceBot, um assistente financeiro e de compras amigável. "
+    "Sua função é analisar o histórico de gastos do usuário e responder a perguntas de forma útil e inteligente, **focando estritamente em gestão financeira, economia e análise de gastos**. "
+    "Use os dados fornecidos para dar conselhos financeiros, identificar padrões de gastos ou responder a perguntas sobre orçamento. **Recuse-se educadamente a responder perguntas que não sejam sobre finanças ou o uso do bot.**"
+    "Mantenha a resposta concisa e em português."
+)
 
-    session = Session()
-    purchases = session.query(Purchase).filter_by(user_id=user_id).all()
-    session.close()
+MODELO_IA = "gpt-4.1-mini" # Usando um modelo eficiente
 
-    if not purchases:
-        context_data = "O usuário ainda não registrou nenhuma compra."
-    else:
-        # Formata o histórico de compras para o prompt da IA
-        history = "\n".join([
-            f"- {p.product} (R$ {p.value:.2f}) na categoria {p.category} em {p.date.strftime('%d/%m/%Y')}"
-            for p in purchases
-        ])
-        total_spent = sum(p.value for p in purchases)
-        context_data = (
-            f"O usuário já gastou um total de R$ {total_spent:.2f} em {len(purchases)} compras. "
-            "Aqui está o histórico detalhado:\n"
-            f"{history}"
-        )
+# Quantas compras recentes entram no prompt, além dos totais por categoria
+COMPRAS_NO_CONTEXTO_IA = 20
+
+# Intervalo mínimo (em segundos) entre edições da mensagem durante o streaming,
+# para não esbarrar no limite de edições do Telegram.
+INTERVALO_EDICAO_IA = 1.0
+
+# Tamanho máximo do texto de uma mensagem no Telegram
+LIMITE_MENSAGEM_TELEGRAM = 4096
 
-    system_prompt = (
-        "Você é o FinanceBot, um assistente financeiro e de compras amigável. "
-        "Sua função é analisar o histórico de gastos do usuário e responder a perguntas de forma útil e inteligente, **focando estritamente em gestão financeira, economia e análise de gastos**. "
-        "Use os dados fornecidos para dar conselhos financeiros, identificar padrões de gastos ou responder a perguntas sobre orçamento. **Recuse-se educadamente a responder perguntas que não sejam sobre finanças ou o uso do bot.**"
-        "Mantenha a resposta concisa e em português."
+# Respostas já dadas, por usuário + versão do histórico + pergunta
+_respostas_ia_cache = TTLCache(maxsize=2048, ttl=900)
+_respostas_ia_lock = asyncio.Lock()
+
+async def entregar_resposta_ia(message: Message, texto: str) -> None:
+    """Coloca a resposta final da IA em `message`, dividindo-a se passar do limite do Telegram."""
+    if not texto:
+        texto = "❌ A IA não retornou nenhuma resposta. Tente reformular sua pergunta."
+    partes = [texto[i:i + LIMITE_MENSAGEM_TELEGRAM] for i in range(0, len(texto), LIMITE_MENSAGEM_TELEGRAM)]
+    try:
+        await editar_mensagem(message, partes[0])
+    except TelegramError as e:
+        # Se a edição falhar (ex.: limite de edições), a resposta vai numa mensagem nova
+        logger.warning(f"Erro ao editar a resposta final da IA, enviando como nova mensagem: {e}")
+        await message.reply_text(partes[0])
+    for parte in partes[1:]:
+        await message.reply_text(parte)
+
+async def editar_mensagem(message: Message, texto: str) -> None:
+    """Edita a mensagem, ignorando o erro de quando o texto não mudou."""
+    try:
+        await message.edit_text(texto)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
+
+async def _completar_individual(user_prompt: str, message: Message = None) -> str:
+    """Faz uma chamada em streaming, editando `message` com a resposta parcial."""
+    response = await obter_openai_client().chat.completions.create(
+        model=MODELO_IA,
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT_IA},
+            {"role": "user", "content": user_prompt}
+        ],
+        stream=True
     )
+    buffer = ""
+    ultima_edicao = time.monotonic()
+    async for chunk in response:
+        if not chunk.choices:
+            continue
+        buffer += chunk.choices[0].delta.content or ""
+        if (
+            message and buffer and len(buffer) <= LIMITE_MENSAGEM_TELEGRAM
+            and time.monotonic() - ultima_edicao >= INTERVALO_EDICAO_IA
+        ):
+            # Falhar uma edição parcial não pode descartar a resposta, que já está sendo paga
+            try:
+                await editar_mensagem(message, buffer)
+            except RetryAfter as e:
+                espera = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                logger.warning(f"Limite de edições do Telegram atingido, pausando a prévia por {espera}s.")
+                ultima_edicao = time.monotonic() + espera
+                continue
+            except TelegramError as e:
+                logger.warning(f"Erro ao editar a prévia da resposta da IA, seguindo sem prévia: {e}")
+                message = None
+            ultima_edicao = time.monotonic()
+    return buffer
 
-    user_prompt = (
+def _montar_prompt_usuario(context_data: str, prompt: str) -> str:
+    """Junta o contexto de gastos e a pergunta do usuário na mensagem enviada à IA."""
+    return (
         f"Contexto de gastos do usuário:\n{context_data}\n\n"
         f"Pergunta do usuário: {prompt}"
     )
 
+def _contexto_gastos(user_id: int, desde: datetime = None) -> tuple:
+    """Monta o resumo de gastos do usuário que vai no prompt da IA.
+
+    Em vez do histórico completo, envia os totais por categoria (calculados no banco) e
+    só as compras mais recentes, para que o prompt tenha tamanho limitado. Com `desde`,
+    o resumo cobre apenas as compras a partir dessa data.
+
+    Retorna (contexto, número de compras, id da última compra); os dois últimos
+    identificam a versão do histórico usada no cache de respostas.
+    """
+    total_spent, num_purchases, ultimo_id, purchases = _resumo_gastos(user_id, COMPRAS_NO_CONTEXTO_IA, desde)
+
+    if not purchases:
+        if desde is not None:
+            return f"O usuário não registrou nenhuma compra desde {desde.strftime('%d/%m/%Y')}.", 0, None
+        return "O usuário ainda não registrou nenhuma compra.", 0, None
+
+    categorias = "\n".join(
+        f"| {categoria} | {total:.2f} | {quantidade} |"
+        for categoria, total, quantidade in _gastos_por_categoria(user_id, desde)
+    )
+    periodo = f"Desde {desde.strftime('%d/%m/%Y')}, o usuário gastou" if desde is not None else "O usuário já gastou"
+    recentes = "\n".join(
+        f"| {p.date.strftime('%d/%m/%Y')} | {p.product} | {p.category} | {p.value:.2f} |"
+        for p in purchases
+    )
+    context_data = (
+        f"{periodo} um total de R$ {total_spent:.2f} em {num_purchases} compras.\n\n"
+        "Gastos por categoria:\n"
+        "| Categoria | Total (R$) | Compras |\n"
+        "|---|---|---|\n"
+        f"{categorias}\n\n"
+        f"Últimas {len(purchases)} compras:\n"
+        "| Data | Produto | Categoria | Valor (R$) |\n"
+        "|---|---|---|---|\n"
+        f"{recentes}"
+    )
+    return context_data, num_purchases, ultimo_id
+
+async def analisar_com_ia(user_id: int, prompt: str, message: Message = None, user_data: dict = None):
+    """Usa a IA para analisar o histórico de gastos e responder perguntas.
+
+    Se `message` for informada, ela é editada com a resposta parcial conforme os tokens
+    chegam. Se `user_data` for informado, o contexto
+    de gastos fica guardado em `user_data['ia_ctx']` até o usuário registrar uma nova compra.
+    """
+    if not OPENAI_API_KEY:
+        return "❌ A funcionalidade de IA está desativada (chave da OpenAI não configurada)."
+
+    if user_data is not None and 'ia_ctx' in user_data:
+        context_data, num_purchases, ultimo_id = user_data['ia_ctx']
+    else:
+        context_data, num_purchases, ultimo_id = await asyncio.to_thread(_contexto_gastos, user_id)
+        if user_data is not None:
+            user_data['ia_ctx'] = (context_data, num_purchases, ultimo_id)
+
+    # Enquanto o usuário não registra uma compra nova, a mesma pergunta tem a mesma resposta
+    chave = hashlib.sha1(f"{user_id}|{num_purchases}|{ultimo_id}|{prompt}".encode("utf-8")).hexdigest()
+    async with _respostas_ia_lock:
+        if chave in _respostas_ia_cache:
+            return _respostas_ia_cache[chave]
+
     try:
-        response = openai_client.chat.completions.create(
-            model="gpt-4.1-mini", # Usando um modelo eficiente
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
-        )
-        return response.choices[0].message.content
+        resposta = await _completar_individual(_montar_prompt_usuario(context_data, prompt), message)
     except Exception as e:
         logger.error(f"Erro na chamada da OpenAI: {e}")
         return "❌ Ocorreu um erro ao consultar a Inteligência Artificial. Verifique sua chave ou limites de uso."
 
+    if resposta:
+        async with _respostas_ia_lock:
+            _respostas_ia_cache[chave] = resposta
+    return resposta
+
+# --- Revisão Semanal (OpenAI Batch API) ---
+# A revisão semanal não precisa de resposta imediata, então vai pela Batch API,
+# que custa metade do preço e tem limites de uso maiores que as chamadas em tempo real.
+
+INTERVALO_CONSULTA_LOTE = 300 # segundos entre consultas ao status do lote
+INTERVALO_ENVIO_REVISAO = 0.05 # pausa entre envios para não estourar o limite de mensagens do Telegram
+
+PROMPT_REVISAO_SEMANAL = (
+    "Faça uma revisão semanal dos gastos do usuário: destaque as categorias com mais gastos, "
+    "padrões que chamem atenção e uma ou duas sugestões práticas de economia."
+)
+
+_revisoes_em_andamento = set()
+
+def pedido_revisao_semanal(user_id: int, context_data: str) -> dict:
+    """Monta a linha do arquivo JSONL da Batch API com a revisão semanal de um usuário."""
+    return {
+        "custom_id": str(user_id),
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": MODELO_IA,
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT_IA},
+                {"role": "user", "content": _montar_prompt_usuario(context_data, PROMPT_REVISAO_SEMANAL)}
+            ]
+        }
+    }
+
+async def revisao_semanal(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job semanal: envia à Batch API a revisão de quem registrou compras na última semana."""
+    if not OPENAI_API_KEY:
+        return
+
+    desde = datetime.now() - timedelta(days=7)
+    user_ids = await asyncio.to_thread(_usuarios_com_compras_desde, desde)
+    if not user_ids:
+        logger.info("📅 Nenhum usuário com compras na última semana, revisão semanal ignorada.")
+        return
+
+    linhas = []
+    for user_id in user_ids:
+        context_data, _, _ = await asyncio.to_thread(_contexto_gastos, user_id, desde)
+        linhas.append(json.dumps(pedido_revisao_semanal(user_id, context_data), ensure_ascii=False))
+
+    try:
+        arquivo = await obter_openai_client().files.create(
+            file=("revisao_semanal.jsonl", "\n".join(linhas).encode("utf-8")),
+            purpose="batch"
+        )
+        lote = await obter_openai_client().batches.create(
+            input_file_id=arquivo.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+    except Exception as e:
+        logger.error(f"Erro ao criar o lote da revisão semanal: {e}")
+        return
+
+    logger.info(f"📅 Revisão semanal enviada para {len(user_ids)} usuários (lote {lote.id}).")
+    await asyncio.to_thread(_registrar_revisao_pendente, lote.id)
+    _iniciar_acompanhamento(context.bot, lote.id)
+
+def _iniciar_acompanhamento(bot, batch_id: str) -> None:
+    """Cria a tarefa que acompanha um lote da revisão semanal até a entrega."""
+    tarefa = asyncio.create_task(acompanhar_revisao_semanal(bot, batch_id))
+    _revisoes_em_andamento.add(tarefa)
+    tarefa.add_done_callback(_revisoes_em_andamento.discard)
+
+async def retomar_revisoes_semanais(bot) -> None:
+    """Volta a acompanhar os lotes que ainda não tinham sido entregues quando o bot parou."""
+    for batch_id in await asyncio.to_thread(_revisoes_pendentes):
+        logger.info(f"📅 Retomando o acompanhamento do lote {batch_id} da revisão semanal.")
+        _iniciar_acompanhamento(bot, batch_id)
+
+async def acompanhar_revisao_semanal(bot, batch_id: str) -> None:
+    """Aguarda o lote terminar, envia a cada usuário a sua revisão e remove o lote dos pendentes."""
+    while True:
+        try:
+            lote = await obter_openai_client().batches.retrieve(batch_id)
+            if lote.status == "completed":
+                await _entregar_revisoes(bot, lote)
+                break
+            if lote.status in ("failed", "expired", "cancelled"):
+                logger.error(f"Lote da revisão semanal {batch_id} terminou com status '{lote.status}'.")
+                break
+        except Exception as e:
+            logger.warning(f"Erro ao acompanhar o lote {batch_id}, tentando de novo: {e}")
+        await asyncio.sleep(INTERVALO_CONSULTA_LOTE)
+
+    await asyncio.to_thread(_remover_revisao_pendente, batch_id)
+
+async def _entregar_revisoes(bot, lote) -> None:
+    """Baixa o arquivo de saída do lote e envia a revisão de cada usuário."""
+    batch_id = lote.id
+    if not lote.output_file_id:
+        logger.error(f"Lote da revisão semanal {batch_id} terminou sem arquivo de saída.")
+        return
+
+    saida = await obter_openai_client().files.content(lote.output_file_id)
+    # Se o acompanhamento for repetido (erro no meio ou reinício do bot), não reenvia o que já foi entregue
+    entregues = await asyncio.to_thread(_revisoes_entregues, batch_id)
+    for linha in saida.text.splitlines():
+        if not linha.strip():
+            continue
+        try:
+            resultado = json.loads(linha)
+            user_id = int(resultado["custom_id"])
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"Linha inválida no resultado do lote {batch_id}, ignorando: {linha[:200]}")
+            continue
+        if user_id in entregues:
+            continue
+        try:
+            texto = resultado["response"]["body"]["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError):
+            logger.warning(f"Revisão semanal sem resposta para o usuário {user_id}.")
+            continue
+        if await _enviar_revisao(bot, user_id, texto):
+            await asyncio.to_thread(_marcar_revisao_entregue, batch_id, user_id)
+            entregues.add(user_id)
+        await asyncio.sleep(INTERVALO_ENVIO_REVISAO)
+
+    logger.info(f"✅ Revisão semanal do lote {batch_id} entregue.")
+
+async def _enviar_revisao(bot, user_id: int, texto: str) -> bool:
+    """Envia a revisão a um usuário, esperando e tentando de novo se o Telegram pedir. Retorna se enviou."""
+    for _ in range(3):
+        try:
+            await bot.send_message(chat_id=user_id, text=f"📅 Sua revisão semanal de gastos:\n\n{texto}")
+            return True
+        except RetryAfter as e:
+            espera = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+            logger.warning(f"Limite de mensagens do Telegram atingido, aguardando {espera}s para enviar a revisão.")
+            await asyncio.sleep(espera)
+        except TelegramError as e:
+            logger.warning(f"Não foi possível enviar a revisão semanal ao usuário {user_id}: {e}")
+            return False
+    logger.warning(f"Revisão semanal não enviada ao usuário {user_id} após várias tentativas.")
+    return False
+
+def parar_revisoes_semanais() -> None:
+    """Cancela o acompanhamento dos lotes ao desligar o bot (eles são retomados na próxima partida)."""
+    for tarefa in _revisoes_em_andamento:
+        tarefa.cancel()
+
 # --- Handlers de Comandos e Mensagens ---
 
+# Formato de uma compra: Produto - Valor - Categoria (grupos já sem espaços nas pontas)
+PURCHASE_RE = re.compile(r"\s*([^-\s][^-]*?)\s*-\s*([\d.,]+)\s*-\s*([^-\s][^-]*?)\s*$")
+# Mesmo formato, mas aceitando qualquer valor: separa "valor inválido" de "formato incorreto"
+PURCHASE_SHAPE_RE = re.compile(r"\s*([^-\s][^-]*?)\s*-\s*([^-]*?)\s*-\s*([^-\s][^-]*?)\s*$")
+
+# Textos e teclado fixos, montados uma vez na importação
+GREETING = 'Olá! Eu sou o FinanceBot. Escolha uma opção abaixo para começar a economizar e rastrear seus gastos:'
+
+MAIN_MENU = InlineKeyboardMarkup([
+    [InlineKeyboardButton("💰 Melhores Deals (DiscountAPI)", callback_data='deals')],
+    [InlineKeyboardButton("🛍️ Buscar na Shopee", callback_data='shopee_search')],
+    [InlineKeyboardButton("🔀 Deals + Última Busca na Shopee", callback_data='combined_search')],
+    [InlineKeyboardButton("💳 Adicionar Compra", callback_data='add_purchase')],
+    [InlineKeyboardButton("📥 Importar Compras", callback_data='import_purchases')],
+    [InlineKeyboardButton("📊 Meus Gastos", callback_data='my_expenses')],
+    [InlineKeyboardButton("🧠 Perguntar à IA", callback_data='ask_ai')], # Nova opção
+    [InlineKeyboardButton("❓ Ajuda", callback_data='help')],
+])
+
+HELP_TEXT = (
+    "❓ *Guia de Uso do FinanceBot* ❓\n\n"
+    f"*{esc('💰 Melhores Deals:')}* {esc('Busca as melhores promoções internacionais (em USD).')}\n"
+    f"*{esc('🛍️ Buscar na Shopee:')}* {esc('Permite buscar produtos na Shopee. Você será solicitado a digitar o termo de busca.')}\n"
+    f"*{esc('🔀 Deals + Última Busca na Shopee:')}* {esc('Mostra os deals do dia junto com os resultados da sua última busca na Shopee.')}\n"
+    f"*{esc('💳 Adicionar Compra:')}* {esc('Registra uma compra. Use o formato:')}\n"
+    "   `Produto - Valor - Categoria` \\(Ex: `iPhone 15 - 5000 - Eletrônicos`\\)\n"
+    f"*{esc('📥 Importar Compras:')}* {esc('Registra várias compras de uma vez, uma por linha, no mesmo formato.')}\n"
+    f"*{esc('📊 Meus Gastos:')}* {esc('Mostra o resumo das suas compras registradas.')}\n"
+    f"*{esc('🧠 Perguntar à IA:')}* {esc('Use a IA para analisar seus gastos e tirar dúvidas financeiras.')}\n"
+)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Envia a mensagem de boas-vindas e o menu principal."""
-    keyboard = [
-        [InlineKeyboardButton("💰 Melhores Deals (DiscountAPI)", callback_data='deals')],
-        [InlineKeyboardButton("🛍️ Buscar na Shopee", callback_data='shopee_search')],
-        [InlineKeyboardButton("💳 Adicionar Compra", callback_data='add_purchase')],
-        [InlineKeyboardButton("📊 Meus Gastos", callback_data='my_expenses')],
-        [InlineKeyboardButton("🧠 Perguntar à IA", callback_data='ask_ai')], # Nova opção
-        [InlineKeyboardButton("❓ Ajuda", callback_data='help')],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await update.message.reply_text(
-        'Olá! Eu sou o FinanceBot. Escolha uma opção abaixo para começar a economizar e rastrear seus gastos:',
-        reply_markup=reply_markup
-    )
+    await update.message.reply_text(GREETING, reply_markup=MAIN_MENU)
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Envia o guia de uso completo."""
-    help_text = (
-        "❓ **Guia de Uso do FinanceBot** ❓\n\n"
-        "**💰 Melhores Deals:** Busca as melhores promoções internacionais (em USD).\n"
-        "**🛍️ Buscar na Shopee:** Permite buscar produtos na Shopee. Você será solicitado a digitar o termo de busca.\n"
-        "**💳 Adicionar Compra:** Registra uma compra. Use o formato:\n"
-        "   `Produto - Valor - Categoria` (Ex: `iPhone 15 - 5000 - Eletrônicos`)\n"
-        "**📊 Meus Gastos:** Mostra o resumo das suas compras registradas.\n"
-        "**🧠 Perguntar à IA:** Use a IA para analisar seus gastos e tirar dúvidas financeiras.\n"
-    )
-    await update.message.reply_text(help_text)
+    await update.message.reply_text(HELP_TEXT, parse_mode='MarkdownV2')
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Processa mensagens de texto para busca na Shopee, registro de compras ou IA."""
@@ -230,30 +778,24 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     if state == 'waiting_shopee_term':
         context.user_data['state'] = None
+        context.user_data['last_shopee_term'] = text
         result = await buscar_shopee_scraping(text)
-        await update.message.reply_text(result, parse_mode='Markdown')
+        await update.message.reply_text(result, parse_mode='MarkdownV2')
         
     elif state == 'waiting_purchase':
         context.user_data['state'] = None
         
         # Validação do formato: Produto - Valor - Categoria
-        parts = [p.strip() for p in text.split('-')]
+        match = PURCHASE_RE.match(text)
         
-        if len(parts) == 3:
-            produto, valor_str, categoria = parts
+        if match:
+            produto, valor_str, categoria = match.groups()
             try:
                 # Persistência de dados (salva no banco)
                 valor = float(valor_str.replace(',', '.'))
-                session = Session()
-                new_purchase = Purchase(
-                    user_id=user_id,
-                    product=produto,
-                    value=valor,
-                    category=categoria
-                )
-                session.add(new_purchase)
-                session.commit()
-                session.close()
+                await asyncio.to_thread(_registrar_compra, user_id, produto, valor, categoria)
+                # O contexto da IA guardado ficou desatualizado
+                context.user_data.pop('ia_ctx', None)
                 
                 await update.message.reply_text(
                     f"✅ Compra registrada com sucesso no banco de dados!\n"
@@ -264,24 +806,66 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 
             except ValueError:
                 await update.message.reply_text("❌ Formato de valor inválido. Use apenas números (ex: 5000 ou 5000.50).")
+        elif PURCHASE_SHAPE_RE.match(text):
+            # Produto e categoria estão preenchidos, o problema é o valor
+            await update.message.reply_text("❌ Formato de valor inválido. Use apenas números (ex: 5000 ou 5000.50).")
         else:
             await update.message.reply_text(
                 "❌ Formato incorreto. Use: `Produto - Valor - Categoria`\n"
                 "Exemplo: `iPhone 15 - 5000 - Eletrônicos`"
             )
             
+    elif state == 'import_csv':
+        context.user_data['state'] = None
+        
+        # Uma compra por linha, no formato: Produto - Valor - Categoria
+        rows = []
+        linhas_invalidas = []
+        for numero, linha in enumerate(text.splitlines(), start=1):
+            if not linha.strip():
+                continue
+            match = PURCHASE_RE.match(linha)
+            if not match:
+                linhas_invalidas.append(str(numero))
+                continue
+            produto, valor_str, categoria = match.groups()
+            try:
+                valor = float(valor_str.replace(',', '.'))
+            except ValueError:
+                linhas_invalidas.append(str(numero))
+                continue
+            rows.append((produto, valor, categoria))
+        
+        if linhas_invalidas:
+            # Nada é salvo se alguma linha estiver errada, para o usuário poder reenviar tudo
+            invalidas = ', '.join(linhas_invalidas)
+            await update.message.reply_text(
+                f"{esc(f'❌ Nenhuma compra foi importada. Linhas com formato inválido: {invalidas}.')}\n"
+                f"{esc('Use uma compra por linha:')} `Produto - Valor - Categoria`",
+                parse_mode='MarkdownV2'
+            )
+            return
+        if not rows:
+            await update.message.reply_text("❌ Nenhuma compra encontrada na mensagem.")
+            return
+        
+        total = await importar_compras(user_id, rows)
+        # O contexto da IA guardado ficou desatualizado
+        context.user_data.pop('ia_ctx', None)
+        await update.message.reply_text(f"✅ {total} compras importadas com sucesso!")
+            
     elif state == 'waiting_ai_prompt':
         context.user_data['state'] = None
-        await update.message.reply_text("🧠 Analisando sua pergunta com a IA...")
-        result = await analisar_com_ia(user_id, text)
-        await update.message.reply_text(result)
+        aviso = await update.message.reply_text("🧠 Analisando sua pergunta com a IA...")
+        result = await analisar_com_ia(user_id, text, aviso, context.user_data)
+        await entregar_resposta_ia(aviso, result)
             
     else:
         # Se a mensagem não for um comando, trata como uma pergunta para a IA (fallback)
-        if openai_client:
-            await update.message.reply_text("🧠 Analisando sua pergunta com a IA...")
-            result = await analisar_com_ia(user_id, text)
-            await update.message.reply_text(result)
+        if OPENAI_API_KEY:
+            aviso = await update.message.reply_text("🧠 Analisando sua pergunta com a IA...")
+            result = await analisar_com_ia(user_id, text, aviso, context.user_data)
+            await entregar_resposta_ia(aviso, result)
         else:
             await update.message.reply_text("Comando não reconhecido. Use /start para ver o menu principal ou /help para o guia de uso.")
 
@@ -296,7 +880,27 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     if data == 'deals':
         result = await buscar_discount_api_real(context)
-        await query.edit_message_text(result, parse_mode='Markdown', disable_web_page_preview=True)
+        await query.edit_message_text(result, parse_mode='MarkdownV2')
+        
+    elif data == 'combined_search':
+        termo = context.user_data.get('last_shopee_term')
+        if not termo:
+            await query.edit_message_text("🛍️ Faça primeiro uma busca na Shopee para que eu possa combiná-la com os deals.")
+            return
+        # As duas buscas são independentes, então rodam ao mesmo tempo
+        resultados = await asyncio.gather(
+            buscar_discount_api_real(context),
+            buscar_shopee_scraping(termo),
+            return_exceptions=True
+        )
+        partes = []
+        for resultado in resultados:
+            if isinstance(resultado, Exception):
+                logger.error(f"Erro na busca combinada: {resultado}")
+                partes.append(esc("❌ Ocorreu um erro em uma das buscas."))
+            else:
+                partes.append(resultado)
+        await query.edit_message_text("\n".join(partes), parse_mode='MarkdownV2')
         
     elif data == 'shopee_search':
         context.user_data['state'] = 'waiting_shopee_term'
@@ -310,8 +914,19 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             "Exemplo: `iPhone 15 - 5000 - Eletrônicos`"
         )
         
+    elif data == 'import_purchases':
+        context.user_data['state'] = 'import_csv'
+        await query.edit_message_text(
+            f"{esc('📥 Envie suas compras em uma única mensagem, uma por linha, no formato:')}\n"
+            "`Produto - Valor - Categoria`\n"
+            "Exemplo:\n"
+            "`iPhone 15 - 5000 - Eletrônicos`\n"
+            "`Mercado - 350,90 - Alimentação`",
+            parse_mode='MarkdownV2'
+        )
+        
     elif data == 'ask_ai': # Novo handler para IA
-        if not openai_client:
+        if not OPENAI_API_KEY:
             await query.edit_message_text("❌ A funcionalidade de IA está desativada (chave da OpenAI não configurada).")
             return
         context.user_data['state'] = 'waiting_ai_prompt'
@@ -321,40 +936,62 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         
     elif data == 'my_expenses':
-        session = Session()
-        purchases = session.query(Purchase).filter_by(user_id=user_id).order_by(Purchase.date.desc()).all()
-        session.close()
+        total_spent, num_purchases, _, purchases = await asyncio.to_thread(_resumo_gastos, user_id, 5)
         
         if not purchases:
             await query.edit_message_text("📊 Você ainda não registrou nenhuma compra no banco de dados.")
             return
-            
-        total_spent = sum(p.value for p in purchases)
-        num_purchases = len(purchases)
         
         message_text = (
-            "📊 **Resumo dos Seus Gastos (Persistente)** 📊\n\n"
-            f"Total Gasto: **R$ {total_spent:.2f}**\n"
-            f"Número de Compras: **{num_purchases}**\n\n"
-            "**Últimas Compras Registradas:**\n"
+            f"📊 *{esc('Resumo dos Seus Gastos (Persistente)')}* 📊\n\n"
+            f"Total Gasto: *{esc(f'R$ {total_spent:.2f}')}*\n"
+            f"Número de Compras: *{num_purchases}*\n\n"
+            "*Últimas Compras Registradas:*\n"
         )
         
         # Mostrar as últimas 5 compras
-        for p in purchases[:5]:
-            message_text += f" - {p.product} (R$ {p.value:.2f}) - {p.category} ({p.date.strftime('%d/%m')})\n"
+        for p in purchases:
+            message_text += esc(f" - {p.product} (R$ {p.value:.2f}) - {p.category} ({p.date.strftime('%d/%m')})") + "\n"
             
-        await query.edit_message_text(message_text, parse_mode='Markdown')
+        await query.edit_message_text(message_text, parse_mode='MarkdownV2')
         
     elif data == 'help':
         await help_command(query, context)
         
+async def ao_iniciar(application: Application) -> None:
+    """Retoma as tarefas que ficaram pendentes na execução anterior do bot."""
+    if OPENAI_API_KEY:
+        await retomar_revisoes_semanais(application.bot)
+
+async def ao_desligar(application: Application) -> None:
+    """Libera os recursos compartilhados quando o bot é desligado."""
+    parar_revisoes_semanais()
+    await fechar_http_client()
+
+# Quantas atualizações do Telegram podem ser processadas ao mesmo tempo
+UPDATES_CONCORRENTES = 16
+
 def main() -> None:
     """Inicia o bot."""
     if not TELEGRAM_BOT_TOKEN:
         logger.error("TELEGRAM_BOT_TOKEN não encontrado. Verifique seu arquivo .env.")
         return
 
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    init_db()
+
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        # Processa várias atualizações ao mesmo tempo: enquanto um usuário espera a
+        # DiscountAPI, a Shopee ou a IA, os outros continuam sendo atendidos
+        .concurrent_updates(UPDATES_CONCORRENTES)
+        # Sem pré-visualização de links em nenhuma resposta: evita que o Telegram busque
+        # a página de cada URL enviada (deals, Shopee e respostas da IA)
+        .defaults(Defaults(link_preview_options=LinkPreviewOptions(is_disabled=True)))
+        .post_init(ao_iniciar)
+        .post_shutdown(ao_desligar)
+        .build()
+    )
 
     # Handlers de comandos
     application.add_handler(CommandHandler("start", start))
@@ -366,6 +1003,10 @@ def main() -> None:
     # Handler de cliques em botões inline
     application.add_handler(CallbackQueryHandler(handle_callback))
 
+    # Revisão semanal de gastos, todo domingo às 12h (UTC)
+    if OPENAI_API_KEY and application.job_queue:
+        application.job_queue.run_daily(revisao_semanal, time=dtime(hour=12), days=(0,), name='revisao_semanal')
+
     logger.info("🚀 Bot iniciado! Pressione Ctrl+C para parar.")
     application.run_polling(allowed_updates=Update.ALL_TYPES)
 